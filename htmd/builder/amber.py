@@ -9,9 +9,10 @@ from __future__ import print_function
 from htmd.home import home
 import numpy as np
 import os
-from glob import glob
 from htmd.molecule.util import _missingSegID, sequenceID
 import shutil
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from htmd.builder.builder import detectDisulfideBonds
 from htmd.builder.builder import _checkMixedSegment, _checkResidueInsertions
 from subprocess import call, check_output, DEVNULL
@@ -49,48 +50,51 @@ def listFiles():
     amberhome = os.path.normpath(os.path.join(os.path.dirname(tleap), '../'))
 
     # Original AMBER FFs
+    # os.scandir is exhausted by each comprehension, which closes it (no context manager support before Python 3.6)
     amberdir = os.path.join(amberhome, 'dat', 'leap', 'cmd')
-    ffs = sorted([f for f in os.listdir(amberdir) if os.path.isfile(os.path.join(amberdir, f))], key=str.lower)
+    ffs = sorted([e.name for e in os.scandir(amberdir) if e.is_file()], key=str.lower)
     print('---- Forcefield files list: ' + os.path.join(amberdir, '') + ' ----')
     for f in ffs:
         print(f)
 
     oldffdir = os.path.join(amberhome, 'dat', 'leap', 'cmd', 'oldff')
-    ffs = sorted([os.path.join('oldff', f) for f in os.listdir(oldffdir) if os.path.isfile(os.path.join(oldffdir, f))], key=str.lower)
+    ffs = sorted([os.path.join('oldff', e.name) for e in os.scandir(oldffdir) if e.is_file()], key=str.lower)
     print('---- OLD Forcefield files list: ' + os.path.join(amberdir, '') + ' ----')
     for f in ffs:
         print(f)
 
     # FRCMOD files
     frcmoddir = os.path.join(amberhome, 'dat', 'leap', 'parm')
-    ffs = sorted([f for f in os.listdir(frcmoddir) if os.path.isfile(os.path.join(frcmoddir, f)) and f.startswith('frcmod')], key=str.lower)
+    ffs = sorted([e.name for e in os.scandir(frcmoddir) if e.is_file() and e.name.startswith('frcmod')], key=str.lower)
     print('---- Parameter files list: ' + os.path.join(frcmoddir, '') + ' ----')
     for f in ffs:
         print(os.path.basename(f))
 
-    # Extra AMBER FFs on HTMD
+    # Extra AMBER FFs on HTMD, and their *.in and *.frcmod files @cuzzo87
     htmdamberdir = os.path.abspath(os.path.join(home(), 'builder', 'amberfiles', ''))
-    extraffs = sorted([os.path.join(f, os.path.basename(glob(os.path.join(htmdamberdir, f) + '/leaprc.*')[0]))
-                for f in os.listdir(htmdamberdir) if os.path.isdir(os.path.join(htmdamberdir, f))
-                and len(glob(os.path.join(htmdamberdir, f) + '/leaprc.*')) == 1], key=str.lower)
+    extraffs = []
+    extratopos = []
+    extraparams = []
+    subdirs = [e for e in os.scandir(htmdamberdir) if e.is_dir()]
+    for d in subdirs:
+        names = [e.name for e in os.scandir(d.path) if not e.name.startswith('.')]
+        leaprcs = [n for n in names if n.startswith('leaprc.')]
+        if len(leaprcs) == 1:
+            extraffs.append(os.path.join(d.name, leaprcs[0]))
+        ins = [n for n in names if n.endswith('.in')]
+        if len(ins) == 1:
+            extratopos.append(d.name + '/' + ins[0])
+        extraparams += [d.name + '/' + n for n in names if n.endswith('.frcmod')]
+    extraffs = sorted(extraffs, key=str.lower)
+
     print('---- Extra forcefield files list: ' + os.path.join(htmdamberdir, '') + ' ----')
     for f in extraffs:
         print(f)
 
-    # Extra AMBER FFs on HTMD (*.frcmod, *.in) @cuzzo87
-    extratopos = [f +  '/' + os.path.basename(glob(os.path.join(htmdamberdir, f) + '/*.in')[0])
-               for f in os.listdir(htmdamberdir) if os.path.isdir(os.path.join(htmdamberdir, f))  
-               and len(glob(os.path.join(htmdamberdir, f) + '/*.in')) == 1  ]
-    
     print('---- Extra *.in files list: ' + os.path.join(htmdamberdir, '') + ' ----')
     for f in extratopos:
         print(f)
 
-    extraparams = [ f + '/' + os.path.basename( os.path.join(htmdamberdir, f) + fparam )
-               for f in os.listdir(htmdamberdir) 
-               for fparam in glob(os.path.join(htmdamberdir, f) + '/*.frcmod' )
-                ]
-    
     print('---- Extra *.in files list: ' + os.path.join(htmdamberdir, '') + ' ----')
     for f in extraparams:
         print(f)
@@ -187,8 +191,10 @@ def build(mol, ff=None, topo=None, param=None, prefix='structure', outdir='./bui
     >>> disu = [DisulfideBridge('P', 157, 'P', 13), DisulfideBridge('K', 1, 'K', 25)]
     >>> molbuilt = amber.build(mol, outdir='/tmp/build', saltconc=0.15, disulfide=disu)  # doctest: +SKIP
     """
+    # Capping swaps atoms in-place in every atom field, so all atom field arrays are copied here. The remaining
+    # attributes are shared, which still avoids a deepcopy of the whole Molecule.
+    mol = mol._shallowCopy(fields=mol._atom_fields)
     # Remove pdb protein bonds as they can be regenerated by tleap. Keep non-protein bonds i.e. for ligands
-    mol = mol.copy()
     _removeProteinBonds(mol)
 
     if shutil.which(tleap) is None:
@@ -213,19 +219,82 @@ def build(mol, ff=None, topo=None, param=None, prefix='structure', outdir='./bui
 
     _applyProteinCaps(mol, caps)
 
-    f = open(os.path.join(outdir, 'tleap.in'), 'w')
+    if isinstance(ff, str):
+        ff = [ff]
+    if atomtypes is not None:
+        atomtypes = ensurelist(tocheck=atomtypes[0], tomod=atomtypes)
+    if offlibraries is not None:
+        if not isinstance(offlibraries, list) and not isinstance(offlibraries, tuple):
+            offlibraries = [offlibraries, ]
+
+    if ionize and execute:
+        # Only the net charge is needed for ionizing, so tleap is run without saving the parameters
+        _writeTleapIn(mol, outdir, ff, topo, param, prefix, disulfide=[], atomtypes=atomtypes,
+                      offlibraries=offlibraries, chargeonly=True)
+        logger.info('Computing the system charge.')
+        logpath = _runTleap(tleap, outdir, ff)
+        totalcharge = _readTleapCharge(logpath)
+        nwater = np.sum(mol.atomselect('water and noh'))
+        anion, cation, anionatom, cationatom, nanion, ncation = ionizef(totalcharge, nwater, saltconc=saltconc, ff='amber', anion=saltanion, cation=saltcation)
+        mol = ionizePlace(mol, anion, cation, anionatom, cationatom, nanion, ncation)
+
+    # Detect disulfide bridges if not defined by user
+    if disulfide is None:
+        logger.info('Detecting disulfide bonds.')
+        disulfide = detectDisulfideBonds(mol)
+
+    # Fix structure to match the disulfide patching
+    if len(disulfide) != 0:
+        # Rename the residues to CYX if there is a disulfide bond
+        cyx = np.zeros(mol.numAtoms, dtype=bool)
+        for d in disulfide:
+            cyx |= (mol.segid == d.segid1) & (mol.resid == d.resid1)
+            cyx |= (mol.segid == d.segid2) & (mol.resid == d.resid2)
+        mol.resname[cyx] = 'CYX'
+        # Remove (eventual) HG hydrogens on these CYS (from proteinPrepare)
+        mol.remove(cyx & (mol.name == 'HG'), _logger=False)
+
+    _writeTleapIn(mol, outdir, ff, topo, param, prefix, disulfide=disulfide, atomtypes=atomtypes,
+                  offlibraries=offlibraries)
+
+    if not execute:
+        return None
+
+    logger.info('Starting the build.')
+    logpath = _runTleap(tleap, outdir, ff)
+    logger.info('Finished building.')
+
+    if os.path.exists(os.path.join(outdir, 'structure.crd')) and \
+                    os.path.getsize(os.path.join(outdir, 'structure.crd')) != 0 and \
+                    os.path.getsize(os.path.join(outdir, 'structure.prmtop')) != 0:
+        molbuilt = Molecule(os.path.join(outdir, 'structure.prmtop'))
+        molbuilt.read(os.path.join(outdir, 'structure.crd'))
+    else:
+        raise NameError('No structure pdb/prmtop file was generated. Check {} for errors in building.'.format(logpath))
+
+    tmpbonds = molbuilt.bonds
+    molbuilt.bonds = []  # Removing the bonds to speed up writing
+    molbuilt.write(os.path.join(outdir, 'structure.pdb'))
+    molbuilt.bonds = tmpbonds  # Restoring the bonds
+    return molbuilt
+
+
+def _writeTleapIn(mol, outdir, ff, topo, param, prefix, disulfide, atomtypes=None, offlibraries=None,
+                  chargeonly=False):
+    """ Writes the tleap.in script and the input structure files it loads into outdir
+
+    If chargeonly is True the script prints the total charge of the system instead of saving the parameters.
+    """
+    f = open(os.path.join(outdir, 'tleap.in'), 'w', buffering=1 << 20)
     f.write('# tleap file generated by amber.build\n')
 
     # Printing out the forcefields
-    if isinstance(ff, str):
-        ff = [ff]
     for force in ff:
         f.write('source ' + force + '\n')
     f.write('\n')
 
     # Adding custom atom types
     if atomtypes is not None:
-        atomtypes = ensurelist(tocheck=atomtypes[0], tomod=atomtypes)
         f.write('addAtomTypes {\n')
         for at in atomtypes:
             if len(at) != 3:
@@ -235,52 +304,39 @@ def build(mol, ff=None, topo=None, param=None, prefix='structure', outdir='./bui
 
     # Loading OFF libraries
     if offlibraries is not None:
-        if not isinstance(offlibraries, list) and not isinstance(offlibraries, tuple):
-            offlibraries = [offlibraries, ]
         for off in offlibraries:
             f.write('loadoff {}\n\n'.format(off))
 
-    # Loading frcmod parameters
-    f.write('# Loading parameter files\n')
-    for p in param:
-        try:
-            shutil.copy(p, outdir)
-            f.write('loadamberparams ' + os.path.basename(p) + '\n')
-        except:
-            f.write('loadamberparams ' + p + '\n')
-            logger.info("File {:s} not found, assuming its present on the standard Amber location".format(p))
-    f.write('\n')
-
-    # Loading prepi topologies
-    f.write('# Loading prepi topologies\n')
-    for t in topo:
-        shutil.copy(t, outdir)
-        f.write('loadamberprep ' + os.path.basename(t) + '\n')
-    f.write('\n')
-
-    # Detect disulfide bridges if not defined by user
-    if disulfide is None and not ionize:
-        logger.info('Detecting disulfide bonds.')
-        disulfide = detectDisulfideBonds(mol)
-
-    # Fix structure to match the disulfide patching
-    if not ionize and len(disulfide) != 0:
-        for d in disulfide:
-            # Rename the residues to CYX if there is a disulfide bond
-            atoms1 = (mol.segid == d.segid1) & (mol.resid == d.resid1)
-            atoms2 = (mol.segid == d.segid2) & (mol.resid == d.resid2)
-            mol.resname[atoms1] = 'CYX'
-            mol.resname[atoms2] = 'CYX'
-            # Remove (eventual) HG hydrogens on these CYS (from proteinPrepare)
-            mol.remove(atoms1 & (mol.name == 'HG'), _logger=False)
-            mol.remove(atoms2 & (mol.name == 'HG'), _logger=False)
-
-    # Printing and loading the PDB file. AMBER can work with a single PDB file if the segments are separate by TER
-    logger.debug('Writing PDB file for input to tleap.')
+    # Copying the parameter and topology files and writing the PDB file are independent, so they run concurrently
     pdbname = os.path.join(outdir, 'input.pdb')
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paramcopies = [pool.submit(shutil.copy, p, outdir) for p in param]
+        topocopies = [pool.submit(shutil.copy, t, outdir) for t in topo]
+        # Printing and loading the PDB file. AMBER can work with a single PDB file if the segments are separate by TER
+        logger.debug('Writing PDB file for input to tleap.')
+        # mol2 files have atomtype, here we only write parts not coming from mol2
+        pdbwrite = pool.submit(mol.write, pdbname, mol.atomtype == '')
+
+        # Loading frcmod parameters
+        lines = ['# Loading parameter files']
+        for p, copied in zip(param, paramcopies):
+            try:
+                copied.result()
+                lines.append('loadamberparams ' + os.path.basename(p))
+            except:
+                lines.append('loadamberparams ' + p)
+                logger.info("File {:s} not found, assuming its present on the standard Amber location".format(p))
+        f.write('\n'.join(lines) + '\n\n')
+
+        # Loading prepi topologies
+        lines = ['# Loading prepi topologies']
+        for t, copied in zip(topo, topocopies):
+            copied.result()
+            lines.append('loadamberprep ' + os.path.basename(t))
+        f.write('\n'.join(lines) + '\n\n')
+
+        pdbwrite.result()
 
-    # mol2 files have atomtype, here we only write parts not coming from mol2
-    mol.write(pdbname, mol.atomtype == '')
     if not os.path.isfile(pdbname):
         raise NameError('Could not write a PDB file out of the given Molecule.')
     f.write('# Loading the system\n')
@@ -302,72 +358,62 @@ def build(mol, ff=None, topo=None, param=None, prefix='structure', outdir='./bui
         combstr += '}\n\n'
         f.write(combstr)
 
-    # Write patches for disulfide bonds (only after ionizing)
-    if not ionize and len(disulfide) != 0:
-        f.write('# Adding disulfide bonds\n')
+    # Write patches for disulfide bonds
+    if len(disulfide) != 0:
+        # Convert to stupid amber residue numbering
+        uqseqid = sequenceID((mol.resid, mol.insertion, mol.segid)) + mol.resid[0]
+        # All atoms of a residue share the same number so the first atom of each residue suffices
+        _, firstidx = np.unique(uqseqid, return_index=True)
+        segres2uqseqid = dict(zip(zip(mol.segid[firstidx], mol.resid[firstidx].tolist()), uqseqid[firstidx].tolist()))
+        lines = ['# Adding disulfide bonds']
         for d in disulfide:
-            # Convert to stupid amber residue numbering
-            uqseqid = sequenceID((mol.resid, mol.insertion, mol.segid)) + mol.resid[0]
-            uqres1 = int(np.unique(uqseqid[(mol.segid == d.segid1) & (mol.resid == d.resid1)]))
-            uqres2 = int(np.unique(uqseqid[(mol.segid == d.segid2) & (mol.resid == d.resid2)]))
-            f.write('bond mol.{}.SG mol.{}.SG\n'.format(uqres1, uqres2))
-        f.write('\n')
-
-    f.write('# Writing out the results\n')
-    f.write('saveamberparm mol ' + prefix + '.prmtop ' + prefix + '.crd\n')
+            uqres1 = segres2uqseqid[(d.segid1, d.resid1)]
+            uqres2 = segres2uqseqid[(d.segid2, d.resid2)]
+            lines.append('bond mol.{}.SG mol.{}.SG'.format(uqres1, uqres2))
+        f.write('\n'.join(lines) + '\n\n')
+
+    if chargeonly:
+        f.write('# Printing the total charge\n')
+        f.write('charge mol\n')
+    else:
+        f.write('# Writing out the results\n')
+        f.write('saveamberparm mol ' + prefix + '.prmtop ' + prefix + '.crd\n')
     f.write('quit')
     f.close()
 
-    molbuilt = None
-    if execute:
-        # Source paths of extra dirs (our dirs, not amber default)
-        htmdamberdir = os.path.abspath(os.path.join(home(), 'builder', 'amberfiles'))
-        sourcepaths = [htmdamberdir]
-        sourcepaths += [os.path.join(htmdamberdir, os.path.dirname(f))
-                        for f in ff if os.path.isfile(os.path.join(htmdamberdir, f))]
-        extrasource = []
-        for p in sourcepaths:
-            extrasource.append('-I')
-            extrasource.append('{}'.format(p))
-        logpath = os.path.abspath(os.path.join(outdir, 'log.txt'))
-        logger.info('Starting the build.')
-        currdir = os.getcwd()
-        os.chdir(outdir)
-        f = open(logpath, 'w')
-        try:
-            cmd = [tleap, '-f', './tleap.in']
-            cmd[1:1] = extrasource
-            call(cmd, stdout=f)
-        except:
-            raise NameError('tleap failed at execution')
-        f.close()
-        os.chdir(currdir)
-        logger.info('Finished building.')
-
-        if os.path.exists(os.path.join(outdir, 'structure.crd')) and \
-                        os.path.getsize(os.path.join(outdir, 'structure.crd')) != 0 and \
-                        os.path.getsize(os.path.join(outdir, 'structure.prmtop')) != 0:
-            molbuilt = Molecule(os.path.join(outdir, 'structure.prmtop'))
-            molbuilt.read(os.path.join(outdir, 'structure.crd'))
-        else:
-            raise NameError('No structure pdb/prmtop file was generated. Check {} for errors in building.'.format(logpath))
-
-        if ionize:
-            shutil.move(os.path.join(outdir, 'structure.crd'), os.path.join(outdir, 'structure.noions.crd'))
-            shutil.move(os.path.join(outdir, 'structure.prmtop'), os.path.join(outdir, 'structure.noions.prmtop'))
-            totalcharge = np.sum(molbuilt.charge)
-            nwater = np.sum(molbuilt.atomselect('water and noh'))
-            anion, cation, anionatom, cationatom, nanion, ncation = ionizef(totalcharge, nwater, saltconc=saltconc, ff='amber', anion=saltanion, cation=saltcation)
-            newmol = ionizePlace(mol, anion, cation, anionatom, cationatom, nanion, ncation)
-            # Redo the whole build but now with ions included
-            return build(newmol, ff=ff, topo=topo, param=param, prefix=prefix, outdir=outdir, caps={}, ionize=False,
-                         execute=execute, saltconc=saltconc, disulfide=disulfide, tleap=tleap, atomtypes=atomtypes,
-                         offlibraries=offlibraries)
-    tmpbonds = molbuilt.bonds
-    molbuilt.bonds = []  # Removing the bonds to speed up writing
-    molbuilt.write(os.path.join(outdir, 'structure.pdb'))
-    molbuilt.bonds = tmpbonds  # Restoring the bonds
-    return molbuilt
+
+def _runTleap(tleap, outdir, ff):
+    # Source paths of extra dirs (our dirs, not amber default)
+    htmdamberdir = os.path.abspath(os.path.join(home(), 'builder', 'amberfiles'))
+    sourcepaths = [htmdamberdir]
+    sourcepaths += [os.path.join(htmdamberdir, os.path.dirname(f))
+                    for f in ff if os.path.isfile(os.path.join(htmdamberdir, f))]
+    extrasource = []
+    for p in sourcepaths:
+        extrasource.append('-I')
+        extrasource.append('{}'.format(p))
+    logpath = os.path.abspath(os.path.join(outdir, 'log.txt'))
+    currdir = os.getcwd()
+    os.chdir(outdir)
+    f = open(logpath, 'w')
+    try:
+        cmd = [tleap, '-f', './tleap.in']
+        cmd[1:1] = extrasource
+        call(cmd, stdout=f)
+    except:
+        raise NameError('tleap failed at execution')
+    f.close()
+    os.chdir(currdir)
+    return logpath
+
+
+def _readTleapCharge(logpath):
+    # Parses the output of the tleap `charge` command
+    with open(logpath, 'r') as f:
+        for line in f:
+            if line.strip().startswith('Total unperturbed charge:'):
+                return float(line.split(':')[1])
+    raise NameError('Could not compute the system charge. Check {} for errors in building.'.format(logpath))
 
 
 def _applyProteinCaps(mol, caps):
@@ -389,15 +435,17 @@ def _applyProteinCaps(mol, caps):
     capresname = ['ACE', 'NME']
     capatomtype = ['C', 'N']
 
+    # Capping only inserts and removes terminal atoms, so the segments containing protein don't change in the loop
+    protsegs = set(mol.segid[mol.atomselect('protein')])
+
     # For each caps definition
     for seg in caps:
-        prot = mol.atomselect('protein')  # Can't move this out since we remove atoms in this loop
         # Get the segment
         segment = np.where(mol.segid == seg)[0]
         # Test segment
         if len(segment) == 0:
             raise RuntimeError('There is no segment {} in the molecule.'.format(seg))
-        if not np.any(prot & (mol.segid == seg)):
+        if seg not in protsegs:
             raise RuntimeError('Segment {} is not protein. Capping for non-protein segments is not supported.'.format(seg))
         # For each cap
         passed = False
@@ -429,10 +477,7 @@ def _applyProteinCaps(mol, caps):
                 continue
 
             # Test if the atom to change exists
-            termatomsids = np.zeros(residm.shape, dtype=bool)
-            for atm in terminalatoms[cap]:
-                termatomsids |= mol.name == atm
-            termatomsids = np.where(termatomsids & segidm & residm)[0]
+            termatomsids = np.where(np.in1d(mol.name, terminalatoms[cap]) & segidm & residm)[0]
 
             if len(termatomsids) == 0:
                 # Create new atom
@@ -463,17 +508,14 @@ def _applyProteinCaps(mol, caps):
                 mol.set('resid', terminalresids[i]-1+2*i, sel=newatom)  # if i=0 => resid-1; i=1 => resid+1
 
                 # Reorder
-                neworder = np.arange(mol.numAtoms)
-                neworder[newatom] = terminalids[i]
-                neworder[terminalids[i]] = newatom
-                _reorderMol(mol, neworder)
+                _swapAtoms(mol, [(newatom, terminalids[i])])
 
         # For each cap
         for i, cap in enumerate(caps[seg]):
             if cap is None or (isinstance(cap, str) and cap == 'none'):
                 continue
             # Remove lingering hydrogens or oxygens in terminals
-            mol.remove('segid {} and resid "{}" and name {}'.format(seg, orig_terminalresids[i], ' '.join(terminalatoms[cap])),
+            mol.remove((mol.segid == seg) & (mol.resid == orig_terminalresids[i]) & np.in1d(mol.name, terminalatoms[cap]),
                        _logger=False)
 
 
@@ -504,10 +546,8 @@ def _defaultProteinCaps(mol):
 
 
 def _cleanOutDir(outdir):
-    from glob import glob
-    files = glob(os.path.join(outdir, 'structure.*'))
-    files += glob(os.path.join(outdir, 'log.*'))
-    files += glob(os.path.join(outdir, '*.log'))
+    files = [e.path for e in os.scandir(outdir) if not e.name.startswith('.') and
+             (e.name.startswith('structure.') or e.name.startswith('log.') or e.name.endswith('.log'))]
     for f in files:
         os.remove(f)
 
@@ -523,55 +563,54 @@ def _charmmLipid2Amber(mol):
     Returns
     -------
     newmol : :class:`Molecule <htmd.molecule.molecule.Molecule>` object
-        A new Molecule object with the membrane converted to AMBER
+        A new Molecule object with the membrane converted to AMBER. If there are no CHARMM lipids in the
+        Molecule the same object is returned unchanged.
     """
 
-    resdict = _readcsvdict(os.path.join(home(), 'builder', 'charmmlipid2amber.csv'))
+    resdict, rules = _readcsvdict(os.path.join(home(), 'builder', 'charmmlipid2amber.csv'))
+
+    # Nothing to convert for systems without CHARMM lipids
+    if resdict.keys().isdisjoint(mol.resname.tolist()):
+        return mol
 
     natoms = mol.numAtoms
     neworder = np.array(list(range(natoms)))  # After renaming the atoms and residues I have to reorder them
 
-    begs = np.zeros(natoms, dtype=bool)
-    fins = np.zeros(natoms, dtype=bool)
-    begters = np.zeros(natoms, dtype=bool)
-    finters = np.zeros(natoms, dtype=bool)
+    # Bit flags marking the first/last atoms of each lipid residue, with and without ters
+    BEG, FIN, BEGTER, FINTER = 1, 2, 4, 8
+    flags = np.zeros(natoms, dtype=np.uint8)
 
-    # Iterate over the translation dictionary
-    mol = mol.copy()
+    # Atom and residue names are renamed in-place. All other fields are replaced by new arrays in _reorderMol
+    mol = mol._shallowCopy(fields=('resname', 'name'))
     incrresids = sequenceID((mol.resid, mol.insertion, mol.segid))
 
-    for res in resdict.keys():
-        molresidx = mol.resname == res
-        if not np.any(molresidx):
-            continue
-        names = mol.name.copy()  # Need to make a copy or I accidentally double-modify atoms
-
-        atommap = resdict[res]
-        for atom in atommap.keys():
-            rule = atommap[atom]
-
-            molatomidx = np.zeros(len(names), dtype=bool)
-            molatomidx[molresidx] = names[molresidx] == atom
-
-            mol.set('resname', rule.replaceresname, sel=molatomidx)
-            mol.set('name', rule.replaceatom, sel=molatomidx)
-            neworder[molatomidx] = rule.order
-
-            if rule.order == 0:  # First atom (with or without ters)
-                begs[molatomidx] = True
-            if rule.order == rule.natoms - 1:  # Last atom (with or without ters)
-                fins[molatomidx] = True
-            if rule.order == 0 and rule.ter:  # First atom with ter
-                begters[molatomidx] = True
-            if rule.order == rule.natoms - 1 and rule.ter:  # Last atom with ter
-                finters[molatomidx] = True
-
-    uqresids = np.unique(incrresids[begs])
-    residuebegs = np.ones(len(uqresids), dtype=int) * -1
-    residuefins = np.ones(len(uqresids), dtype=int) * -1
-    for i in range(len(uqresids)):
-        residuebegs[i] = np.where(incrresids == uqresids[i])[0][0]
-        residuefins[i] = np.where(incrresids == uqresids[i])[0][-1]
+    # Look up the translation rule of every atom in a single pass over the (resname, name) pairs
+    atomrules = [rules.get(k) for k in zip(mol.resname.tolist(), mol.name.tolist())]
+    matched = np.fromiter((r is not None for r in atomrules), dtype=bool, count=natoms)
+
+    if np.any(matched):
+        matchedrules = [r for r in atomrules if r is not None]
+        order = np.array([r.order for r in matchedrules], dtype=int)
+        last = np.array([r.natoms - 1 for r in matchedrules], dtype=int)
+        ter = np.array([r.ter for r in matchedrules], dtype=bool)
+
+        mol.resname[matched] = np.array([r.replaceresname for r in matchedrules], dtype=mol.resname.dtype)
+        mol.name[matched] = np.array([r.replaceatom for r in matchedrules], dtype=mol.name.dtype)
+        neworder[matched] = order
+
+        isbeg = order == 0
+        isfin = order == last
+        flags[matched] = BEG * isbeg \
+                         | FIN * isfin \
+                         | BEGTER * (isbeg & ter) \
+                         | FINTER * (isfin & ter)
+
+    # First and last atom index of every residue containing a first lipid atom
+    uqresids, firstidx = np.unique(incrresids, return_index=True)
+    lastidx = natoms - 1 - np.unique(incrresids[::-1], return_index=True)[1]
+    lipidres = np.in1d(uqresids, incrresids[(flags & BEG) != 0])
+    residuebegs = firstidx[lipidres]
+    residuefins = lastidx[lipidres]
     for i in range(len(residuebegs)):
         beg = residuebegs[i]
         fin = residuefins[i] + 1
@@ -580,8 +619,9 @@ def _charmmLipid2Amber(mol):
 
     _reorderMol(mol, idx)
 
-    begters = np.where(begters[idx])[0]  # Sort the begs and ters
-    finters = np.where(finters[idx])[0]
+    flags = flags[idx]  # Sort the begs and ters
+    begters = np.where(flags & BEGTER)[0]
+    finters = np.where(flags & FINTER)[0]
 
     #if len(begters) > 999:
     #    raise NameError('More than 999 lipids. Cannot define separate segments for all of them.')
@@ -596,38 +636,58 @@ def _charmmLipid2Amber(mol):
 
 
 def _reorderMol(mol, order):
+    fields = [(k, mol.__dict__[k]) for k in mol._atom_fields
+              if mol.__dict__[k] is not None and np.size(mol.__dict__[k]) != 0]
+    for k, data in fields:
+        reordered = np.empty_like(data)
+        # order is a valid permutation, so mode='clip' only skips the buffering numpy does for out in 'raise' mode
+        np.take(data, order, axis=0, out=reordered, mode='clip')
+        mol.__dict__[k] = reordered
+
+
+def _swapAtoms(mol, pairs):
+    # Swaps the atoms of each (i, j) index pair in-place
     for k in mol._atom_fields:
-        if mol.__dict__[k] is not None and np.size(mol.__dict__[k]) != 0:
-            if k == 'coords':
-                mol.__dict__[k] = mol.__dict__[k][order, :, :]
-            else:
-                mol.__dict__[k] = mol.__dict__[k][order]
+        data = mol.__dict__[k]
+        if data is None or np.size(data) == 0:
+            continue
+        for i, j in pairs:
+            data[[i, j]] = data[[j, i]]
 
 
 def _readcsvdict(filename):
-    import csv
-    from collections import namedtuple
-    if os.path.isfile(filename):
-        csvfile = open(filename, 'r')
-    else:
+    if not os.path.isfile(filename):
         raise NameError('File ' + filename + ' does not exist')
+    # Keyed on the modification time so that edits to the file are picked up without restarting
+    return _readcsvdictCached(filename, os.path.getmtime(filename))
+
+
+@lru_cache(maxsize=4)
+def _readcsvdictCached(filename, mtime):
+    # The returned dictionaries are shared between calls. Do not modify them.
+    import pandas as pd
+    from collections import namedtuple
 
     resdict = dict()
+    rules = dict()  # Flattened (resname, atomname) -> Rule mapping
 
     Rule = namedtuple('Rule', ['replaceresname', 'replaceatom', 'order', 'natoms', 'ter'])
 
     # Skip header line of csv file. Line 2 contains dictionary keys:
-    csvfile.readline()
-    csvreader = csv.DictReader(csvfile)
-    for line in csvreader:
-        searchres = line['search'].split()[1]
-        searchatm = line['search'].split()[0]
+    df = pd.read_csv(filename, skiprows=1, dtype={'search': str, 'replace': str, 'TER': str}, keep_default_na=False)
+    search = df['search'].str.split(expand=True)
+    replace = df['replace'].str.split(expand=True)
+    ter = df['TER'] == 'True'
+
+    for searchatm, searchres, replaceatm, replaceres, order, natoms, t in zip(search[0], search[1], replace[0],
+                                                                              replace[1], df['order'],
+                                                                              df['num_atom'], ter):
         if searchres not in resdict:
             resdict[searchres] = dict()
-        resdict[searchres][searchatm] = Rule(line['replace'].split()[1], line['replace'].split()[0], int(line['order']), int(line['num_atom']), line['TER'] == 'True')
-    csvfile.close()
+        resdict[searchres][searchatm] = Rule(replaceres, replaceatm, int(order), int(natoms), bool(t))
+        rules[(searchres, searchatm)] = resdict[searchres][searchatm]
 
-    return resdict
+    return resdict, rules
 
 
 if __name__ == '__main__':
@@ -647,6 +707,30 @@ if __name__ == '__main__':
     if failure_count != 0:
         raise Exception('Doctests failed')
 
+    # Test parsing the system charge from the output of a charge-only tleap run (captured tleap stdout)
+    chargelog = tempname(suffix='.txt')
+    with open(chargelog, 'w') as f:
+        f.write('-f: Source ./tleap.in.\n'
+                '\n'
+                'Welcome to LEaP!\n'
+                'Sourcing: ./tleap.in\n'
+                'Loading PDB file: ./input.pdb\n'
+                '  total atoms in file: 7184\n'
+                'Total unperturbed charge:  -6.000000\n'
+                'Total perturbed charge:    -6.000000\n'
+                '\tQuit\n')
+    assert _readTleapCharge(chargelog) == -6
+    with open(chargelog, 'w') as f:
+        f.write('Welcome to LEaP!\n'
+                'Could not open file input.pdb: not found\n')
+    try:
+        _readTleapCharge(chargelog)
+    except NameError:
+        pass
+    else:
+        raise RuntimeError('_readTleapCharge did not fail on a tleap log without a charge')
+    os.remove(chargelog)
+
     def cutfirstline(infile, outfile):
         # Cut out the first line of prmtop which has a build date in it
         with open(infile, 'r') as fin:
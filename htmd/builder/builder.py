@@ -112,13 +112,14 @@ def detectDisulfideBonds(mol, thresh=3):
     disubonds : np.ndarray
         A list of :class:`DisulfideBridge <htmd.builder.builder.DisulfideBridge>` objects
     """
-    from scipy.spatial.distance import pdist, squareform
+    from scipy.spatial import cKDTree
     from scipy.sparse.csgraph import connected_components
     import pandas as pd
     disubonds = []
 
     # Find all SG atoms belonging to resnames starting with CY
-    idx = np.where([(rn[0:2] == 'CY') and (n == 'SG') for rn, n in zip(mol.resname, mol.name)])[0] # 'resname "CY.*" and name SG'
+    idx = np.where(mol.name == 'SG')[0]
+    idx = idx[[rn[0:2] == 'CY' for rn in mol.resname[idx]]]  # 'resname "CY.*" and name SG'
     if len(idx) == 0:
             return disubonds
 
@@ -141,18 +142,17 @@ def detectDisulfideBonds(mol, thresh=3):
         if len(df['indexes'][groups[k]].tolist()) != 1:
             raise RuntimeError('Multiple SG atoms detected in segment {} resid {}. Can\'t guess disulfide bridges.'.format(k[1], k[0]))
 
-    sd = squareform(pdist(mol.coords[idx, :, mol.frame]))
-    sd[np.diag_indices(sd.shape[0])] = thresh+1  # Set the diagonal over threshold
-    close = sd < thresh
-    rows, cols = np.where(close)
+    # Only query the pairs of SG atoms within the threshold instead of computing all pairwise distances
+    sgcoords = mol.coords[idx, :, mol.frame]
+    close = sorted(cKDTree(sgcoords).query_pairs(r=thresh))
+    close = [(r, c) for r, c in close if np.linalg.norm(sgcoords[r] - sgcoords[c]) < thresh]
 
-    numbonds = np.sum(close, axis=0)
+    numbonds = np.bincount(np.array(close, dtype=int).ravel(), minlength=len(idx))
     if np.any(numbonds > 1):
         pairs = [(s, r) for r, s in zip(resids[np.where(numbonds > 1)[0]], segids[np.where(numbonds > 1)[0]])]
         raise RuntimeError('SG atoms with (segid, resid) pairs {} have multiple possible bonds. Cannot guess disulfide bonds. Please specify them manually.'.format(pairs))
 
-    uniquerowcols = list(set([tuple(sorted((r, c))) for r, c in zip(rows, cols)]))
-    for rc in uniquerowcols:
+    for rc in close:
         disubonds.append(DisulfideBridge(segids[rc[0]], resids[rc[0]], segids[rc[1]], resids[rc[1]]))
         msg = 'Bond between A: [serial {0} resid {1} resname {2} chain {3} segid {4}]\n' \
               '             B: [serial {5} resid {6} resname {7} chain {8} segid {9}]\n'.format(
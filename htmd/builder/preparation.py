@@ -3,8 +3,8 @@
 # Distributed under HTMD Software License Agreement
 # No redistribution in whole or part
 #
+import io
 import logging
-import tempfile
 
 import numpy as np
 import propka.lib
@@ -28,24 +28,23 @@ def _selToHoldList(mol, sel):
     return ret
 
 
-def _fillMolecule(name, resname, chain, resid, insertion, coords, segid, element,
-                  occupancy, beta, charge, record):
-    numAtoms = len(name)
+def _fillMolecule(atoms):
+    # atoms is a structured array with one record per atom, as built by _buildResAndMol.
+    # Columns are copied so that the Molecule fields are contiguous and don't keep the record array alive.
+    numAtoms = len(atoms)
     mol = Molecule()
     mol.empty(numAtoms)
 
-    mol.name = np.array(name, dtype=mol._dtypes['name'])
-    mol.resname = np.array(resname, dtype=mol._dtypes['resname'])
-    mol.chain = np.array(chain, dtype=mol._dtypes['chain'])
-    mol.resid = np.array(resid, dtype=mol._dtypes['resid'])
-    mol.insertion = np.array(insertion, dtype=mol._dtypes['insertion'])
-    mol.coords = np.array(np.atleast_3d(np.vstack(coords)), dtype=mol._dtypes['coords'])
-    mol.segid = np.array(segid, dtype=mol._dtypes['segid'])
-    mol.element = np.array(element, dtype=mol._dtypes['element'])
-    mol.occupancy = np.array(occupancy, dtype=mol._dtypes['occupancy'])
-    mol.beta = np.array(beta, dtype=mol._dtypes['beta'])
-    # mol.charge = np.array(charge, dtype=mol._dtypes['charge'])
-    # mol.record = np.array(record, dtype=mol._dtypes['record'])
+    mol.name = atoms['name'].copy()
+    mol.resname = atoms['resname'].copy()
+    mol.chain = atoms['chain'].copy()
+    mol.resid = atoms['resid'].copy()
+    mol.insertion = atoms['insertion'].copy()
+    mol.coords = np.atleast_3d(np.ascontiguousarray(atoms['coords']))
+    mol.segid = atoms['segid'].copy()
+    mol.element = atoms['element'].copy()
+    mol.occupancy = atoms['occupancy'].copy()
+    mol.beta = atoms['beta'].copy()
     return mol
 
 
@@ -67,68 +66,55 @@ def _buildResAndMol(pdb2pqr_protein):
     # because I need to access the properties.
     logger.debug("Building Molecule object.")
 
-    name = []
-    resid = []
-    chain = []
-    insertion = []
-    coords = []
-    resname = []
-    segid = []
-    element = []
-    occupancy = []
-    beta = []
-    record = []
-    charge = []
-
     prepData = PreparationData()
 
-    for i, residue in enumerate(pdb2pqr_protein.residues):
-        # if 'ffname' in residue.__dict__:
-        if getattr(residue, 'ffname', None):
-            curr_resname = residue.ffname
-            if len(curr_resname) >= 4:
-                curr_resname = curr_resname[-3:]
-                logger.debug("Residue %s has internal name %s, replacing with %s" %
-                             (residue, residue.ffname, curr_resname))
-        else:
-            curr_resname = residue.name
-
-        prepData._setProtonationState(residue, curr_resname)
-
-        # Removed because not really useful
-        # if getattr(residue, 'patches', None):
-        #     for patch in residue.patches:
-        #         prepData._appendPatches(residue, patch)
-        #         if patch != "PEPTIDE":
-        #             logger.debug("Residue %s has patch %s set" % (residue, patch))
-
-        if getattr(residue, 'wasFlipped', 'UNDEF') != 'UNDEF':
-            prepData._setFlipped(residue, residue.wasFlipped)
-
-        prepData._set(residue, 'pdb2pqr_idx', i)
-
-        for atom in residue.atoms:
-            name.append(atom.name)
-            resid.append(residue.resSeq)
-            chain.append(residue.chainID)
-            insertion.append(residue.iCode)
-            coords.append([atom.x, atom.y, atom.z])
-            resname.append(curr_resname)
-            segid.append(atom.segID)
-            # Fixup element fields for added H (routines.addHydrogens)
-            elt = "H" if atom.added and atom.name.startswith("H") else atom.element
-            element.append(elt)
-            occupancy.append(0.0 if atom.added else atom.occupancy)
-            beta.append(99.0 if atom.added else atom.tempFactor)
-            charge.append(atom.charge)
-            record.append(atom.type)
-            if atom.added:
-                logger.debug("Coordinates of atom {:s} in residue {:s} were guessed".format(residue.__str__(),atom.name))
-                prepData._set(residue, 'guessedAtoms', atom.name, append=True)
-
-
-    mol_out = _fillMolecule(name, resname, chain, resid, insertion, coords, segid, element,
-                            occupancy, beta, charge, record)
+    def atomRecords():
+        for i, residue in enumerate(pdb2pqr_protein.residues):
+            # if 'ffname' in residue.__dict__:
+            if getattr(residue, 'ffname', None):
+                curr_resname = residue.ffname
+                if len(curr_resname) >= 4:
+                    curr_resname = curr_resname[-3:]
+                    logger.debug("Residue %s has internal name %s, replacing with %s" %
+                                 (residue, residue.ffname, curr_resname))
+            else:
+                curr_resname = residue.name
+
+            prepData._setProtonationState(residue, curr_resname)
+
+            # Removed because not really useful
+            # if getattr(residue, 'patches', None):
+            #     for patch in residue.patches:
+            #         prepData._appendPatches(residue, patch)
+            #         if patch != "PEPTIDE":
+            #             logger.debug("Residue %s has patch %s set" % (residue, patch))
+
+            if getattr(residue, 'wasFlipped', 'UNDEF') != 'UNDEF':
+                prepData._setFlipped(residue, residue.wasFlipped)
+
+            prepData._set(residue, 'pdb2pqr_idx', i)
+
+            for atom in residue.atoms:
+                if atom.added:
+                    logger.debug("Coordinates of atom {:s} in residue {:s} were guessed".format(residue.__str__(),atom.name))
+                    prepData._set(residue, 'guessedAtoms', atom.name, append=True)
+                yield (atom.name, curr_resname, residue.chainID, residue.resSeq, residue.iCode,
+                       (atom.x, atom.y, atom.z), atom.segID,
+                       # Fixup element fields for added H (routines.addHydrogens)
+                       "H" if atom.added and atom.name.startswith("H") else atom.element,
+                       0.0 if atom.added else atom.occupancy,
+                       99.0 if atom.added else atom.tempFactor)
+
+    # Gather all atoms in a single pass over the residues into a structured array. String fields are kept as objects
+    # like in Molecule, so np.array is used since np.fromiter does not support object fields.
+    atomdtype = np.dtype([('name', Molecule._dtypes['name']), ('resname', Molecule._dtypes['resname']),
+                          ('chain', Molecule._dtypes['chain']), ('resid', Molecule._dtypes['resid']),
+                          ('insertion', Molecule._dtypes['insertion']), ('coords', Molecule._dtypes['coords'], (3,)),
+                          ('segid', Molecule._dtypes['segid']), ('element', Molecule._dtypes['element']),
+                          ('occupancy', Molecule._dtypes['occupancy']), ('beta', Molecule._dtypes['beta'])])
+    atoms = np.array(list(atomRecords()), dtype=atomdtype)
+
+    mol_out = _fillMolecule(atoms)
     # mol_out.set("element", " ")
     # Re-calculating elements
     mol_out.element[:] = ''
@@ -312,11 +298,11 @@ def proteinPrepare(mol_in,
     # We could transform the molecule into an internal object, but for
     # now I prefer to rely on the strange internal parser to avoid
     # hidden quirks.
-    tmpin = tempfile.NamedTemporaryFile(suffix=".pdb", mode="w+")
-    logger.debug("Temporary file is " + tmpin.name)
-    mol_in.write(tmpin.name)  # Not sure this is good unix
+    pdbin = io.StringIO()
+    mol_in.write(pdbin, type='pdb')
+    pdbin.seek(0)
 
-    pdblist, errlist = readPDB(tmpin)
+    pdblist, errlist = readPDB(pdbin)
     if len(pdblist) == 0 and len(errlist) == 0:
         raise Exception('Internal error in preparing input to pdb2pqr')
 
@@ -356,7 +342,7 @@ def proteinPrepare(mol_in,
         logger.error("Problem calling pdb2pqr. Make sure you have htmd-pdb2pqr >= 2.1.2a9")
         raise
 
-    tmpin.close()
+    pdbin.close()
 
     # Diagnostics
     for missedligand in missedLigands:
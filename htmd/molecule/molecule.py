@@ -11,7 +11,7 @@ from htmd.molecule.wrap import wrap
 from htmd.rotationmatrix import rotationMatrix
 from htmd.vmdviewer import getCurrentViewer
 from htmd.util import tempname
-from copy import deepcopy
+from copy import deepcopy, copy as shallowcopy
 from os import path
 import logging
 import os
@@ -561,6 +561,34 @@ class Molecule:
         """
         return deepcopy(self)
 
+    def _shallowCopy(self, fields=()):
+        """ Create a copy of the molecule object which shares its data arrays with this one, apart from `fields`
+
+        Only use it when the shared arrays will not be modified in-place in either of the two objects. The same holds
+        for the other mutable attributes (e.g. the `fileloc`, `time` and `step` lists), which are also shared. The
+        representations are rebuilt so that they refer to the new object.
+
+        Parameters
+        ----------
+        fields : list of str
+            The fields which will be copied instead of shared
+
+        Returns
+        -------
+        newmol : :class:`Molecule`
+            A shallow copy of the object
+        """
+        newmol = shallowcopy(self)
+        for f in fields:
+            if self.__dict__[f] is not None:
+                newmol.__dict__[f] = self.__dict__[f].copy()
+        # Representations hold a reference to their Molecule
+        for r in ('reps', '_tempreps'):
+            if r in self.__dict__:
+                newmol.__dict__[r] = Representations(newmol)
+                newmol.__dict__[r].replist = list(self.__dict__[r].replist)
+        return newmol
+
     def filter(self, sel, _logger=True):
         """Removes all atoms not included in the atomselection
 
@@ -1176,8 +1204,9 @@ class Molecule:
 
         Parameters
         ----------
-        filename : str
-            The filename of the file we want to write to disk
+        filename : str or file
+            The filename of the file we want to write to disk. For the pdb format this can also be an open text
+            stream, in which case `type` has to be given.
         sel : str, optional
             The atomselections of the atoms we want to write. If None it will write all atoms
         type : str, optional
@@ -1186,7 +1215,7 @@ class Molecule:
         from htmd.molecule.writers import _WRITERS
         if type:
             type = type.lower()
-        ext = os.path.splitext(filename)[1][1:]
+        ext = os.path.splitext(filename)[1][1:] if isinstance(filename, str) else ''
 
         src = self
         if not (sel is None or (isinstance(sel, str) and sel == 'all')):
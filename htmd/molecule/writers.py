@@ -145,7 +145,9 @@ def PDBwrite(mol, filename, frame=None):
     numFrames = coords.shape[2]
     serial = np.arange(1, np.size(coords, 0) + 1)
 
-    fh = open(filename, 'w')
+    # Allow writing to an already open text stream (e.g. io.StringIO) which is left open
+    # A large write buffer reduces the number of write calls for big systems
+    fh = filename if hasattr(filename, 'write') else open(filename, 'w', buffering=1 << 20)
     # TODO FIXME  -- should take box from traj frame
     box = mol.box
     if box is not None and not np.all(mol.box == 0):
@@ -204,7 +206,8 @@ def PDBwrite(mol, filename, frame=None):
         print("ENDMDL", file=fh)
     print("END", file=fh)
 
-    fh.close()
+    if fh is not filename:
+        fh.close()
 
 
 def XTCwrite(mol, filename):
@@ -509,6 +512,18 @@ if __name__ == '__main__':
         mol.write(tmp)
         print('Can write {} files'.format(ext))
 
+    # Writing a PDB to an open text stream gives the same text as writing to a file, and leaves the stream open
+    import io
+    tmp = tempname(suffix='.pdb')
+    mol.write(tmp)
+    buf = io.StringIO()
+    mol.write(buf, type='pdb')
+    assert not buf.closed, 'PDBwrite closed the stream it was given'
+    with open(tmp, 'r') as f:
+        assert buf.getvalue() == f.read(), 'Writing a PDB to a text stream differs from writing it to a file'
+    buf.close()
+    print('Can write pdb files to text streams')
+
 
     # from difflib import Differ
     # d = Differ()